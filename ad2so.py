@@ -38,13 +38,17 @@
 #   -g [GBLATTR ...], --gblAttr [GBLATTR ...]
 #                         input global shaper attributes (optional)
 
-import xml.etree.ElementTree as ET
 import argparse
+import re
 import sys
 
-gblTree = None
-gblShaperAttrs = None
-grpShaperAttrs = None
+# lxml parses and writes much faster; fall back to the standard library if it isn't installed
+try:
+    import lxml.etree as ET
+    usingLxml = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    usingLxml = False
 
 nameSpaces = {
                 "w3":"http://www.w3.org/2000/svg",
@@ -52,104 +56,200 @@ nameSpaces = {
                 "shaper":"http://www.shapertools.com/namespaces/shaper"
             }
 
+serifIdAttr = "{" + nameSpaces["serif"] + "}id"
+shaperNameSpace = "{" + nameSpaces["shaper"] + "}"
+svgTag = "{" + nameSpaces["w3"] + "}svg"
+groupTag = "{" + nameSpaces["w3"] + "}g"
+shaperTokenPattern = re.compile(r"(?<!\S)shaper:[A-Za-z_][\w.-]*=\S+")
+gblAttrPattern = re.compile(r"(?:shaper:)?[A-Za-z_][\w.-]*=.+")
+
+def shaper_qname(name):
+    '''
+        Converts a shaper:name attribute name to the {namespace}name form lxml expects. The
+        standard library keeps the shaper: prefix, which svg_add_xmlns declares on the root.
+    '''
+
+    if not usingLxml:
+        return name
+
+    prefix, sep, localName = name.partition(":")
+
+    if sep and prefix == "shaper":
+        return shaperNameSpace + localName
+
+    return name
+
+def parse_shaper_attributes(shaperAttrs):
+    '''
+        Splits shaper:name=value strings into an {attribute name: value} dict ready for elem.attrib.update.
+    '''
+
+    shaperAttrDict = {}
+
+    for shaperAttr in shaperAttrs:
+        name, sep, value = shaperAttr.partition("=")
+        shaperAttrDict[shaper_qname(name)] = value
+
+    return shaperAttrDict
+
+def serif_shaper_attributes(serifId):
+    '''
+        Returns the {attribute name: value} dict for the shaper:name=value tokens in a serif:id.
+    '''
+
+    if "shaper:" not in serifId:
+        return {}
+
+    return parse_shaper_attributes(shaperTokenPattern.findall(serifId))
+
 def set_group_attributes(elem):
     '''
-        Extracts and adds the shaper: attributes to the element.
+        Extracts the shaper: attributes from the group element. They are returned
+        and applied to the following elements that have no serif:id of their own.
     '''    
-    
-    global grpShaperAttrs
 
-    serifNameSpace = "{" + nameSpaces["serif"] + "}id"
+    serifId = elem.get(serifIdAttr)
+
+    if serifId is None:
+        return None
 
-    try:
-        serifId = elem.attrib[serifNameSpace]
-        serifIdWords = serifId.split()
-        grpShaperAttrs = [s for s in serifIdWords if "shaper:" in s]
-    except KeyError:
-        grpShaperAttrs = None  
+    return serif_shaper_attributes(serifId)
 
-def svg_add_xmlns(elem):
+def svg_add_xmlns(tree):
     '''
-        Adds the shaper namespace to the SVG element
+        Adds the shaper namespace to the SVG root element and returns the tree. The standard
+        library takes it as a plain xmlns:shaper attribute. lxml cannot add a namespace to an
+        existing element, so the root is rebuilt with shaper in its nsmap and the children
+        moved across before any shaper attribute is set.
     '''    
 
-    global gblTree
+    root = tree.getroot()
 
-    print(f"Adding xmlns:shaper={nameSpaces['shaper']} attribute to {elem.tag[-3:]} element....")
-    elem.set("xmlns:shaper",nameSpaces["shaper"])
+    print(f"Adding xmlns:shaper={nameSpaces['shaper']} attribute to {root.tag[-3:]} element....")
 
+    if not usingLxml:
+        root.set("xmlns:shaper",nameSpaces["shaper"])
+        return tree
 
-def svg_add_attribute(elem):
-    
-    global gblTree
+    nsmap = dict(root.nsmap)
+    nsmap["shaper"] = nameSpaces["shaper"]
 
-    serifNameSpace = "{" + nameSpaces["serif"] + "}id"
+    newRoot = ET.Element(root.tag,root.attrib,nsmap=nsmap)
+    newRoot.text = root.text
+    newRoot.extend(list(root))
 
-    try:
-        if gblShaperAttrs:
-            for shaperAttr in gblShaperAttrs:
-                shaperList = shaperAttr.split("=")
-                elem.set(shaperList[0],shaperList[1])
+    newTree = ET.ElementTree(newRoot)
 
-        serifId = elem.attrib[serifNameSpace]
-        serifIdWords = serifId.split()
-        shaperAttrs = [s for s in serifIdWords if "shaper:" in s]
+    if tree.docinfo.doctype:
+        newTree.docinfo.public_id = tree.docinfo.public_id
+        newTree.docinfo.system_url = tree.docinfo.system_url
 
-        for shaperAttr in shaperAttrs:
-            shaperList = shaperAttr.split("=")
-            elem.set(shaperList[0],shaperList[1])
+    return newTree
 
-    except KeyError:
-        if grpShaperAttrs:
-            for shaperAttr in grpShaperAttrs:
-                shaperList = shaperAttr.split("=")
-                elem.set(shaperList[0],shaperList[1])
-    finally:
-        pass
 
+def svg_add_attribute(elem,grpShaperAttrs,gblShaperAttrs):
 
- 
-# Define and get the command line options
+    if gblShaperAttrs:
+        elem.attrib.update(gblShaperAttrs)
 
-# initiate the parser
+    serifId = elem.get(serifIdAttr)
 
-parser = argparse.ArgumentParser(description="Shaper Origin Support for AD2")
+    if serifId is None:
+        if grpShaperAttrs:
+            elem.attrib.update(grpShaperAttrs)
+    else:
+        shaperAttrs = serif_shaper_attributes(serifId)
 
-# Add the argument options
+        if shaperAttrs:
+            elem.attrib.update(shaperAttrs)
 
-parser.add_argument("-i","--inFile",help="input SVG file",action="store",required=True)
-parser.add_argument("-o","--outFile",help="output SVG file",action="store",required=True)
-parser.add_argument("-g","--gblAttr",help="input global shaper attributes (optional)",action="store",required=False,nargs='*')
+def process_svg(inFile,gblShaperAttrs):
+    '''
+        Parses the input file, adds the shaper: attributes to its elements and
+        returns the resulting tree.
+    '''
 
-# read arguments from the command line
+    # bind the names used for every element to locals
+    svgTagName = svgTag
+    groupTagName = groupTag
+    setGroupAttributes = set_group_attributes
+    addAttribute = svg_add_attribute
 
-args = parser.parse_args()
+    grpShaperAttrs = None
 
-if args.gblAttr:
-    gblShaperAttrs = args.gblAttr
- 
-# We think we should register some name spaces
+    if usingLxml:
+        parser = ET.XMLParser(huge_tree=True,remove_blank_text=False)
+        tree = ET.parse(inFile,parser)
+    else:
+        tree = ET.parse(inFile)
 
-ET.register_namespace('',nameSpaces["w3"])
-ET.register_namespace("serif",nameSpaces["serif"])
-ET.register_namespace("shaper",nameSpaces["shaper"])
+    # add the namespace before any shaper attribute is set
 
-# Get the input file and parse the tree
-print(f"Reading and parsing {args.inFile}....")
-gblTree = ET.parse(args.inFile)
+    tree = svg_add_xmlns(tree)
 
-# iterate through the elements
+    # iterate through the elements (lxml also keeps comments and processing instructions, which are skipped)
 
-for elem in gblTree.iter():
-    # add the namespace
-    if "svg" in elem.tag[-3:]:
-        svg_add_xmlns(elem)
-    # group level? 
-    elif "g" in elem.tag[-1:]:
-        set_group_attributes(elem)
+    if usingLxml:
+        elements = tree.iter(ET.Element)
     else:
-        # check and add the attributes
-        svg_add_attribute(elem)
+        elements = tree.iter()
+
+    for elem in elements:
+        tag = elem.tag
+        # svg elements take no shaper attributes (files without a default namespace use the bare tags)
+        if tag == svgTagName or tag == "svg":
+            continue
+        # group level? 
+        elif tag == groupTagName or tag == "g":
+            grpShaperAttrs = setGroupAttributes(elem)
+        else:
+            # check and add the attributes
+            addAttribute(elem,grpShaperAttrs,gblShaperAttrs)
+
+    return tree
+
+def main():
+    '''
+        Reads the command line options, converts the input file and writes the output file.
+    '''
+
+    # Define and get the command line options
+
+    # initiate the parser
+
+    parser = argparse.ArgumentParser(description="Shaper Origin Support for AD2")
+
+    # Add the argument options
+
+    parser.add_argument("-i","--inFile",help="input SVG file",action="store",required=True)
+    parser.add_argument("-o","--outFile",help="output SVG file",action="store",required=True)
+    parser.add_argument("-g","--gblAttr",help="input global shaper attributes (optional)",action="store",required=False,nargs='*')
+
+    # read arguments from the command line
+
+    args = parser.parse_args()
+
+    gblShaperAttrs = None
+
+    if args.gblAttr:
+        for gblAttr in args.gblAttr:
+            if not gblAttrPattern.fullmatch(gblAttr):
+                parser.error(f"global attribute {gblAttr} is not valid, expected shaper:name=value")
+
+        gblShaperAttrs = parse_shaper_attributes(args.gblAttr)
+ 
+    # The standard library writes the prefixes registered here
+
+    if not usingLxml:
+        ET.register_namespace('',nameSpaces["w3"])
+        ET.register_namespace("serif",nameSpaces["serif"])
+
+    print(f"Reading and parsing {args.inFile}....")
+    tree = process_svg(args.inFile,gblShaperAttrs)
+
+    print(f"Writing {args.outFile}....")
+    with open(args.outFile,"wb") as outFile:
+        tree.write(outFile,encoding="utf-8",xml_declaration=True)
 
-print(f"Writing {args.outFile}....")
-gblTree.write(args.outFile)
+if __name__ == "__main__":
+    main()